@@ -3,7 +3,7 @@
 Batch convert DWG files to STL format.
 
 Two-phase pipeline:
-  1. DWG -> DXF (via ODA File Converter, cached in data/dxf_cache)
+  1. DWG -> DXF (via ODA File Converter, batched, cached in data/dxf_cache)
   2. DXF -> STL (parallel, via ezdxf + trimesh)
 
 Usage:
@@ -14,20 +14,68 @@ Usage:
 
 import os
 import sys
-import glob
+import fnmatch
 import argparse
 import time
 from pathlib import Path
 from multiprocessing import Pool, cpu_count
-from typing import List, Tuple, Optional
+from typing import Iterator, List, NamedTuple, Set, Tuple, Optional
 
-from dwg_to_stl import dwg_to_dxf, dxf_to_stl, DXF_CACHE_DIR
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None  # optional: single progress bar instead of a line per file
 
+from dwg_to_stl import dwg_to_dxf_many, dxf_to_stl, DXF_CACHE_DIR
 
-def find_cad_files(directory: str, pattern: str = "*.dwg", recursive: bool = True) -> List[str]:
-    search_pattern = os.path.join(directory, "**", pattern) if recursive else os.path.join(directory, pattern)
-    files = glob.glob(search_pattern, recursive=recursive)
-    return [os.path.abspath(f) for f in files]
+# Recycle each worker after this many conversions so memory held by
+# ezdxf/trimesh across conversions is returned to the OS
+MAX_TASKS_PER_CHILD = 50
+
+
+class ConversionResult(NamedTuple):
+    name: str
+    success: bool
+    error: str = ""
+
+
+def _overlaps(a: str, b: str) -> bool:
+    """True if real paths `a` and `b` are the same tree or one contains the other."""
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def _walk(directory: str, pattern: str, recursive: bool, trees: List[str]) -> Iterator[str]:
+    # DirEntry.is_dir() answers from the directory listing itself for plain
+    # entries, so only symlinks cost an extra stat. Symlinked directories are
+    # followed like glob('**') did, unless they lead into a tree already
+    # being walked (`trees`: real paths of the root and followed links),
+    # which would yield duplicates or loop forever. Like glob, hidden entries
+    # (e.g. macOS ._*.dwg metadata) and unreadable directories are skipped.
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                if not recursive:
+                    continue
+                if entry.is_symlink():
+                    target = os.path.realpath(entry.path)
+                    if any(_overlaps(target, tree) for tree in trees):
+                        continue
+                    trees.append(target)
+                yield from _walk(entry.path, pattern, recursive, trees)
+            elif fnmatch.fnmatch(entry.name, pattern):
+                yield entry.path
+
+
+def find_cad_files(directory: str, pattern: str = "*.dwg", recursive: bool = True) -> Iterator[str]:
+    """Yield absolute paths of matching files lazily, as the tree is walked."""
+    root = os.path.abspath(directory)
+    return _walk(root, pattern, recursive, [os.path.realpath(root)])
 
 
 def get_output_filename(cad_file: str) -> str:
@@ -35,14 +83,41 @@ def get_output_filename(cad_file: str) -> str:
     return os.path.splitext(name)[0] + '.stl'
 
 
-def convert_dxf_to_stl(args: Tuple[str, str]) -> Tuple[str, bool, str]:
-    """Worker function: convert a single DXF to STL. Returns (filename, success, error)."""
+def get_output_path(cad_file: str, output_dir: Optional[str] = None) -> str:
+    """STL path for `cad_file`: in `output_dir` if given, else next to the source."""
+    return os.path.join(output_dir or os.path.dirname(cad_file), get_output_filename(cad_file))
+
+
+def existing_stl_names(directory: str) -> Set[str]:
+    """Lowercased names of the STL files in `directory`, from one listing instead of a stat per file."""
+    try:
+        with os.scandir(directory) as entries:
+            return {e.name.lower() for e in entries if e.name.lower().endswith('.stl')}
+    except FileNotFoundError:
+        return set()
+
+
+def _init_worker(verbose: bool) -> None:
+    """Pool initializer: silence per-file conversion output unless verbose.
+
+    Redirects fd 1 itself, so output from C extensions that bypass
+    sys.stdout is dropped as well.
+    """
+    if not verbose:
+        sys.stdout.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.close(devnull)
+
+
+def convert_dxf_to_stl(args: Tuple[str, str]) -> ConversionResult:
+    """Worker function: convert a single DXF to STL."""
     dxf_file, stl_file = args
     try:
         dxf_to_stl(dxf_file, stl_file)
-        return (os.path.basename(stl_file), True, "")
+        return ConversionResult(os.path.basename(stl_file), True)
     except Exception as e:
-        return (os.path.basename(dxf_file), False, str(e))
+        return ConversionResult(os.path.basename(dxf_file), False, str(e))
 
 
 def batch_convert(directory, pattern='*.dwg', skip_existing=False,
@@ -54,72 +129,100 @@ def batch_convert(directory, pattern='*.dwg', skip_existing=False,
     if not os.path.isdir(directory):
         raise FileNotFoundError(f"Directory not found: {directory}")
 
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
     cache_dir = Path(dxf_cache) if dxf_cache else DXF_CACHE_DIR
 
-    dwg_files = find_cad_files(directory, pattern)
-    print(f"Found {len(dwg_files)} DWG files")
-    if not dwg_files:
+    # Output paths are resolved once; the skip check and the workers use the
+    # same ones. Skipped files are dropped while walking, never collected.
+    found = 0
+    jobs = []
+    listings = {}
+    for dwg_file in find_cad_files(directory, pattern):
+        found += 1
+        stl_path = get_output_path(dwg_file, output_dir)
+        if skip_existing:
+            target_dir, stl_name = os.path.split(stl_path)
+            if target_dir not in listings:
+                listings[target_dir] = existing_stl_names(target_dir)
+            if stl_name.lower() in listings[target_dir]:
+                continue
+        jobs.append((dwg_file, stl_path))
+
+    print(f"Found {found} DWG files")
+    if not found:
         return 0, []
+    skipped = found - len(jobs)
+    if skipped > 0:
+        print(f"Skipping {skipped} files with existing STL outputs")
 
-    if skip_existing:
-        original_count = len(dwg_files)
-        filtered = []
-        for f in dwg_files:
-            stl_name = get_output_filename(f)
-            stl_path = os.path.join(output_dir, stl_name) if output_dir else os.path.join(os.path.dirname(f), stl_name)
-            if not os.path.exists(stl_path):
-                filtered.append(f)
-        skipped = original_count - len(filtered)
-        if skipped > 0:
-            print(f"Skipping {skipped} files with existing STL outputs")
-        dwg_files = filtered
-
-    if not dwg_files:
+    if not jobs:
         print("All files already converted!")
         return 0, []
 
-    # Phase 1: DWG -> DXF (sequential, cached)
-    print(f"\n--- Phase 1: DWG -> DXF ({len(dwg_files)} files) ---")
+    # Phase 1: DWG -> DXF (one ODA run for all uncached files, cached)
+    print(f"\n--- Phase 1: DWG -> DXF ({len(jobs)} files) ---")
     dxf_files = []
     start_time = time.time()
-    for i, dwg_file in enumerate(dwg_files, 1):
+    cached = {}
+    for dwg, _ in jobs:
+        dxf_path = cache_dir / Path(dwg).with_suffix('.dxf').name
+        if dxf_path.exists():
+            cached[dwg] = dxf_path
+    try:
+        converted = dwg_to_dxf_many([dwg for dwg, _ in jobs], cache_dir)
+    except Exception as e:
+        print(f"DWG -> DXF conversion failed: {e}")
+        converted = cached
+    for i, (dwg_file, stl_path) in enumerate(jobs, 1):
         name = os.path.basename(dwg_file)
-        dxf_path = cache_dir / Path(dwg_file).with_suffix('.dxf').name
-        cached = dxf_path.exists()
-        try:
-            dxf = dwg_to_dxf(dwg_file, cache_dir)
-            status = "CACHED" if cached else "OK"
-            dxf_files.append((dwg_file, str(dxf)))
-        except Exception:
+        dxf = converted.get(dwg_file)
+        if dxf is None:
             status = "FAIL"
-            dxf_files.append((dwg_file, None))
-        print(f"[{i}/{len(dwg_files)}] {status} {name}")
+            dxf_files.append((None, stl_path))
+        else:
+            status = "CACHED" if dwg_file in cached else "OK"
+            dxf_files.append((str(dxf), stl_path))
+        print(f"[{i}/{len(jobs)}] {status} {name}")
     phase1_time = time.time() - start_time
-    valid = [(dwg, dxf) for dwg, dxf in dxf_files if dxf is not None]
-    print(f"Phase 1 done: {len(valid)}/{len(dwg_files)} converted in {phase1_time:.1f}s")
+    stl_args = [(dxf, stl) for dxf, stl in dxf_files if dxf is not None]
+    print(f"Phase 1 done: {len(stl_args)}/{len(jobs)} converted in {phase1_time:.1f}s")
 
     # Phase 2: DXF -> STL (parallel)
     workers = workers or max(1, cpu_count() - 1)
-    print(f"\n--- Phase 2: DXF -> STL ({len(valid)} files, {workers} workers) ---")
-    stl_args = []
-    for dwg_file, dxf_file in valid:
-        stl_name = get_output_filename(dwg_file)
-        stl_path = os.path.join(output_dir, stl_name) if output_dir else os.path.join(os.path.dirname(dwg_file), stl_name)
-        stl_args.append((dxf_file, stl_path))
+    print(f"\n--- Phase 2: DXF -> STL ({len(stl_args)} files, {workers} workers) ---")
+
+    # Largest DXFs first (LPT) so a big tile never starts last and holds up
+    # the tail. Dispatched one at a time: a chunk of the sorted list would
+    # hand one worker all the largest files. Each conversion takes seconds,
+    # so the per-task IPC is negligible.
+    stl_args.sort(key=lambda a: os.path.getsize(a[0]), reverse=True)
+
+    # Create every output directory up front so workers only write files
+    for parent in {os.path.dirname(stl) for _, stl in stl_args}:
+        os.makedirs(parent, exist_ok=True)
 
     start_time = time.time()
     successful = 0
     failed = []
-    with Pool(processes=workers) as pool:
+    # One rate-limited progress line instead of a terminal write per file;
+    # verbose runs keep per-file lines so they read alongside worker output
+    bar = tqdm(total=len(stl_args), unit='file') if tqdm is not None and not verbose else None
+    with Pool(processes=workers, maxtasksperchild=MAX_TASKS_PER_CHILD,
+              initializer=_init_worker, initargs=(verbose,)) as pool:
         for i, (name, ok, error) in enumerate(pool.imap_unordered(convert_dxf_to_stl, stl_args), 1):
             if ok:
                 successful += 1
-                print(f"[{i}/{len(stl_args)}] OK {name}")
+                if bar is None:
+                    print(f"[{i}/{len(stl_args)}] OK {name}")
             else:
                 failed.append((name, error))
-                print(f"[{i}/{len(stl_args)}] FAIL {name}: {error}")
+                if bar is None:
+                    print(f"[{i}/{len(stl_args)}] FAIL {name}: {error}")
+                else:
+                    bar.write(f"FAIL {name}: {error}")
+            if bar is not None:
+                bar.update(1)
+    if bar is not None:
+        bar.close()
     phase2_time = time.time() - start_time
 
     print(f"\n{'='*60}")
@@ -144,6 +247,7 @@ def main():
     parser.add_argument('--workers', type=int, default=None, help='Parallel workers for DXF->STL (default: CPU count - 1)')
     parser.add_argument('--output', default=None, help='Output directory for STL files')
     parser.add_argument('--dxf-cache', default=None, help=f'DXF cache directory (default: {DXF_CACHE_DIR})')
+    parser.add_argument('--verbose', action='store_true', help='Show per-file conversion details from workers')
     args = parser.parse_args()
 
     _, failed = batch_convert(
@@ -151,6 +255,7 @@ def main():
         pattern=args.pattern,
         skip_existing=args.skip_existing,
         workers=args.workers,
+        verbose=args.verbose,
         output_dir=args.output,
         dxf_cache=args.dxf_cache,
     )
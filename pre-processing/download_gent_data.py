@@ -13,53 +13,204 @@ Usage:
 import os
 import sys
 import json
+import codecs
 import argparse
+import itertools
+import shutil
+import struct
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterator, Optional
 import zipfile
-import io
+import tempfile
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
 except ImportError:
     print("ERROR: requests library not installed. Run:")
     print("  pip install requests")
     sys.exit(1)
 
+try:
+    from remotezip import RemoteZip, RemoteZipError
+except ImportError:
+    RemoteZip = None  # optional: fetch only the DWG members via Range requests
+
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None  # optional: ISA-L inflate, faster than zlib on x86-64
+
 
 # API endpoint for the Gent 3D dataset
 GENT_3D_API = "https://data.stad.gent/api/explore/v2.1/catalog/datasets/gent-in-3d/exports/json"
 
+# ZIPs up to this size are buffered in memory, larger ones spill to disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+INDEX_CHUNK_SIZE = 64 * 1024
+
+# Concurrent tile downloads
+DOWNLOAD_WORKERS = 8
+
+# print() writes the text and the newline separately, so lines from
+# download threads would run together without one locked write per line
+_PRINT_LOCK = threading.Lock()
+
+
+def _http_adapter(workers: int) -> HTTPAdapter:
+    """Keep-alive adapter with one pooled connection per download thread.
 
-def fetch_dataset_index() -> List[Dict]:
+    Transient gateway errors are retried with backoff instead of failing
+    the tile.
     """
-    Fetch the complete dataset index from the Gent 3D API.
+    return HTTPAdapter(
+        pool_maxsize=workers,
+        max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+    )
 
-    Returns:
-        List of dictionaries containing 'vaknummer' and 'link_naar_open_data'
+
+# One keep-alive session for the index and all download threads, so each
+# request reuses a pooled TCP/TLS connection. download_all_tiles remounts
+# the adapter sized to its worker count.
+SESSION = requests.Session()
+SESSION.mount('https://', _http_adapter(DOWNLOAD_WORKERS))
+
+
+def _log(line: str) -> None:
+    """Print one whole line, safe to call from download threads."""
+    with _PRINT_LOCK:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def iter_dataset_index() -> Iterator[Dict]:
+    """
+    Stream the dataset index from the Gent 3D API.
+
+    The export is a JSON array; each tile is yielded as soon as its object
+    has arrived, so downloads can start before the whole index is in.
+
+    Yields:
+        Dictionaries containing 'vaknummer' and 'link_naar_open_data'
     """
     print("Fetching dataset index from Gent 3D API...")
     print(f"API: {GENT_3D_API}\n")
 
-    try:
-        response = requests.get(GENT_3D_API, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    started = False
 
-        print(f"[OK] Found {len(data)} tiles in the dataset\n")
-        return data
+    try:
+        with SESSION.get(GENT_3D_API, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            print(f"Index size: {response.headers.get('content-length', 'unknown')} bytes "
+                  f"({response.headers.get('content-encoding', 'identity')})")
+
+            for chunk in response.iter_content(INDEX_CHUNK_SIZE):
+                buf += utf8.decode(chunk)
+                pos = 0
+                while True:
+                    # Skip the array punctuation between tile objects
+                    while pos < len(buf) and buf[pos] in ' \t\r\n,[]':
+                        started = started or buf[pos] == '['
+                        pos += 1
+                    if not started or pos == len(buf):
+                        break
+                    try:
+                        tile, pos = decoder.raw_decode(buf, pos)
+                    except json.JSONDecodeError:
+                        break  # object not complete yet; wait for more data
+                    yield tile
+                buf = buf[pos:]
 
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Failed to fetch dataset index: {e}")
+        _log(f"[ERROR] Failed to fetch dataset index: {e}")
+        sys.exit(1)
+
+    if buf.strip():
+        _log(f"[ERROR] Malformed dataset index near: {buf[:80]!r}")
         sys.exit(1)
 
 
+def _inflate_isal(zip_file: zipfile.ZipFile, info: zipfile.ZipInfo, dst) -> None:
+    """Inflate a DEFLATE member with ISA-L, reading its raw bytes from the archive."""
+    fp = zip_file.fp
+    fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, fp.read(zipfile.sizeFileHeader))
+    if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+    fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+
+    inflater = isal_zlib.decompressobj(-15)  # raw DEFLATE stream, as stored in ZIPs
+    crc = 0
+    remaining = info.compress_size
+    while remaining:
+        chunk = fp.read(min(EXTRACT_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+        remaining -= len(chunk)
+        data = inflater.decompress(chunk)
+        crc = isal_zlib.crc32(data, crc)
+        dst.write(data)
+    data = inflater.flush()
+    crc = isal_zlib.crc32(data, crc)
+    dst.write(data)
+    if crc != info.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+
+
+def _extract_members(zip_file: zipfile.ZipFile, tile_dir: Path, dwg_only: bool = False) -> None:
+    """Extract members with 1 MiB copies instead of extractall's small reads."""
+    root = tile_dir.resolve()
+    for info in zip_file.infolist():
+        if info.is_dir() or (dwg_only and not info.filename.lower().endswith('.dwg')):
+            continue
+        target = (root / info.filename).resolve()
+        if root not in target.parents:
+            continue  # never write outside the tile directory
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, 'wb', buffering=0) as dst:
+            if (isal_zlib is not None and info.compress_type == zipfile.ZIP_DEFLATED
+                    and not info.flag_bits & 0x1):  # not encrypted
+                _inflate_isal(zip_file, info, dst)
+            else:
+                with zip_file.open(info) as src:
+                    shutil.copyfileobj(src, dst, EXTRACT_CHUNK_SIZE)
+
+
+def _extract_ranged(url: str, tile_dir: Path) -> None:
+    """Extract only the DWG members, fetching just their byte ranges."""
+    with RemoteZip(url, session=SESSION, timeout=60) as zip_file:
+        _extract_members(zip_file, tile_dir, dwg_only=True)
+
+
+def _extract_streamed(url: str, tile_dir: Path) -> Optional[str]:
+    """Download the whole ZIP and extract it. Returns its Content-Length."""
+    # Stream into a spooled temp file: small ZIPs stay in memory, large
+    # ones spill to disk instead of being held whole in RAM.
+    with SESSION.get(url, stream=True, timeout=60) as response, \
+            tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as tmp:
+        response.raise_for_status()
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            tmp.write(chunk)
+        tmp.seek(0)
+
+        with zipfile.ZipFile(tmp) as zip_file:
+            _extract_members(zip_file, tile_dir)
+        return response.headers.get('content-length')
+
+
 def download_and_extract_tile(
     tile: Dict,
     output_dir: Path,
-    index: int,
-    total: int
+    index: int
 ) -> bool:
     """
     Download and extract a single tile ZIP file.
@@ -68,7 +219,6 @@ def download_and_extract_tile(
         tile: Dictionary with 'vaknummer' and 'link_naar_open_data'
         output_dir: Base output directory
         index: Current tile index (for progress display)
-        total: Total number of tiles
 
     Returns:
         True if successful, False otherwise
@@ -76,8 +226,10 @@ def download_and_extract_tile(
     vaknummer = tile.get('vaknummer', 'unknown')
     url = tile.get('link_naar_open_data')
 
+    prefix = f"[{index}]"
+
     if not url:
-        print(f"[{index}/{total}] SKIP {vaknummer} - No download URL")
+        _log(f"{prefix} SKIP {vaknummer} - No download URL")
         return False
 
     # Extract directory name from URL
@@ -88,46 +240,54 @@ def download_and_extract_tile(
 
     # Check if already downloaded
     if tile_dir.exists() and any(tile_dir.glob('*.dwg')):
-        print(f"[{index}/{total}] SKIP {vaknummer} - Already downloaded")
+        _log(f"{prefix} SKIP {vaknummer} - Already downloaded")
         return True
 
     # Create output directory
     tile_dir.mkdir(parents=True, exist_ok=True)
 
     try:
-        # Download ZIP file
-        print(f"[{index}/{total}] Downloading {vaknummer}...", end=' ', flush=True)
-
-        response = requests.get(url, timeout=60)
-        response.raise_for_status()
-
-        # Extract ZIP file
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
-            zip_file.extractall(tile_dir)
+        # Only pull the DWG byte ranges when remotezip is installed and the
+        # server supports it, otherwise download the whole ZIP
+        content_length = None
+        ranged = False
+        if RemoteZip is not None:
+            head = SESSION.head(url, timeout=30, allow_redirects=True)
+            ranged = head.ok and head.headers.get('accept-ranges') == 'bytes'
+        if ranged:
+            try:
+                _extract_ranged(url, tile_dir)
+                content_length = head.headers.get('content-length')
+            except RemoteZipError:
+                ranged = False  # e.g. suffix ranges not supported after all
+        if not ranged:
+            content_length = _extract_streamed(url, tile_dir)
 
         # Count DWG files
         dwg_files = list(tile_dir.glob('*.dwg'))
-        print(f"OK ({len(dwg_files)} DWG files)")
+        size = f"{int(content_length) / (1024 * 1024):.1f} MB, " if content_length else ""
+        _log(f"{prefix} OK {vaknummer} ({size}{len(dwg_files)} DWG files)")
 
         return True
 
     except requests.exceptions.RequestException as e:
-        print(f"FAIL - Download error: {e}")
+        _log(f"{prefix} FAIL {vaknummer} - Download error: {e}")
         return False
 
     except zipfile.BadZipFile as e:
-        print(f"FAIL - Invalid ZIP file: {e}")
+        _log(f"{prefix} FAIL {vaknummer} - Invalid ZIP file: {e}")
         return False
 
     except Exception as e:
-        print(f"FAIL - {type(e).__name__}: {e}")
+        _log(f"{prefix} FAIL {vaknummer} - {type(e).__name__}: {e}")
         return False
 
 
 def download_all_tiles(
     output_dir: Path,
     limit: int = None,
-    skip_existing: bool = True
+    skip_existing: bool = True,
+    workers: int = DOWNLOAD_WORKERS
 ) -> tuple:
     """
     Download all tiles from the Gent 3D dataset.
@@ -136,16 +296,21 @@ def download_all_tiles(
         output_dir: Directory to save downloaded files
         limit: Maximum number of tiles to download (None = all)
         skip_existing: Skip tiles that are already downloaded
+        workers: Number of tiles downloaded concurrently
 
     Returns:
         Tuple of (successful_count, failed_count)
     """
-    # Fetch dataset index
-    tiles = fetch_dataset_index()
+    # Pool one connection per worker; a smaller pool would drop connections
+    # ("Connection pool is full") and reconnect over TLS per request
+    SESSION.mount('https://', _http_adapter(workers))
+
+    # Stream the dataset index; downloads are queued as tiles arrive
+    tiles = iter_dataset_index()
 
     # Apply limit if specified
     if limit:
-        tiles = tiles[:limit]
+        tiles = itertools.islice(tiles, limit)
         print(f"Limiting download to first {limit} tiles\n")
 
     # Create output directory
@@ -154,21 +319,25 @@ def download_all_tiles(
 
     # Download tiles
     print("="*60)
-    print("DOWNLOADING TILES")
+    print(f"DOWNLOADING TILES ({workers} workers)")
     print("="*60)
 
     start_time = time.time()
     successful = 0
     failed = 0
 
-    for i, tile in enumerate(tiles, 1):
-        if download_and_extract_tile(tile, output_dir, i, len(tiles)):
-            successful += 1
-        else:
-            failed += 1
-
-        # Small delay to be nice to the server
-        time.sleep(0.5)
+    # Downloads are network-bound, so threads overlap the per-tile latency
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(download_and_extract_tile, tile, output_dir, i)
+            for i, tile in enumerate(tiles, 1)
+        ]
+        _log(f"[OK] Queued {len(futures)} tiles from the dataset index")
+        for future in as_completed(futures):
+            if future.result():
+                successful += 1
+            else:
+                failed += 1
 
     elapsed = time.time() - start_time
 
@@ -176,7 +345,7 @@ def download_all_tiles(
     print("\n" + "="*60)
     print("DOWNLOAD SUMMARY")
     print("="*60)
-    print(f"Total tiles: {len(tiles)}")
+    print(f"Total tiles: {len(futures)}")
     print(f"Successful: {successful}")
     print(f"Failed: {failed}")
     print(f"Time elapsed: {elapsed:.1f}s")
@@ -196,6 +365,7 @@ Examples:
   python download_gent_data.py
   python download_gent_data.py --output data/
   python download_gent_data.py --limit 10
+  python download_gent_data.py --workers 4
   python download_gent_data.py --no-skip-existing
         """
     )
@@ -213,6 +383,13 @@ Examples:
         help='Limit number of tiles to download (for testing)'
     )
 
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DOWNLOAD_WORKERS,
+        help=f'Concurrent downloads (default: {DOWNLOAD_WORKERS})'
+    )
+
     parser.add_argument(
         '--no-skip-existing',
         action='store_true',
@@ -228,7 +405,8 @@ Examples:
     successful, failed = download_all_tiles(
         output_dir,
         limit=args.limit,
-        skip_existing=skip_existing
+        skip_existing=skip_existing,
+        workers=args.workers
     )
 
     # Exit with error code if any downloads failed
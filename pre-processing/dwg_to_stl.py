@@ -4,15 +4,19 @@ Supports DWG files via ODA File Converter (ezdxf.addons.odafc).
 DXF intermediates are cached to avoid repeated ODA conversions.
 """
 
+import os
 import sys
 import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 import numpy as np
 
 try:
     import ezdxf
     from ezdxf.disassemble import recursive_decompose
+    from ezdxf.protocols import SupportsVirtualEntities
     import trimesh
 except ImportError:
     print("ERROR: Required libraries not installed. Run:")
@@ -22,6 +26,20 @@ except ImportError:
 # Default cache directory for intermediate DXF files
 DXF_CACHE_DIR = Path(__file__).parent.parent / 'data' / 'dxf_cache'
 
+# Vertices closer than this (meters) are treated as the same point
+VERTEX_TOL = 1e-3
+
+# Block references per thread-pool task when placing INSERTs in parallel
+INSERT_BATCH = 100
+
+# One binary STL triangle: normal, 3 vertices, attribute byte count (50 bytes)
+STL_RECORD = np.dtype([
+    ('normal', '<f4', 3), ('v0', '<f4', 3), ('v1', '<f4', 3), ('v2', '<f4', 3), ('attr', '<u2'),
+])
+
+# Faces per slice when filling the memory-mapped STL records
+STL_WRITE_CHUNK = 1 << 20
+
 
 def _setup_oda():
     """Ensure ODA File Converter is available."""
@@ -70,14 +88,114 @@ def dwg_to_dxf(dwg_path, cache_dir=None):
     return dxf_path
 
 
-def extract_edges(stl_path, edge_path, angle_threshold=10):
+def dwg_to_dxf_many(dwg_paths, cache_dir=None):
+    """Convert several DWGs to DXF with one ODA File Converter run per DWG version.
+
+    Starting the converter dominates the cost of small files, so uncached
+    DWGs are staged into one folder and converted together. Returns
+    {dwg_path: dxf_path}, with None for files the converter did not produce.
+    """
+    if cache_dir is None:
+        cache_dir = DXF_CACHE_DIR
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    pending = {}  # DWG version -> [(key, absolute dwg path)]
+    odafc = None
+    for key in dwg_paths:
+        dwg_path = Path(key).absolute()
+        dxf_path = cache_dir / dwg_path.with_suffix('.dxf').name
+        if dxf_path.exists():
+            results[key] = dxf_path
+            continue
+        if odafc is None:
+            odafc = _setup_oda()
+        try:
+            version = odafc._detect_version(str(dwg_path))
+        except (odafc.UnsupportedVersion, OSError) as e:
+            # Truncated or unknown-version DWG: fail this file only
+            print(f"  Cannot read {dwg_path.name}: {e}")
+            results[key] = None
+            continue
+        pending.setdefault(version, []).append((key, dwg_path))
+
+    for version, group in pending.items():
+        with tempfile.TemporaryDirectory(prefix='odafc_') as tmp_dir:
+            in_dir = Path(tmp_dir) / 'in'
+            out_dir = Path(tmp_dir) / 'out'
+            in_dir.mkdir()
+            out_dir.mkdir()
+            staged_group = []
+            for key, dwg_path in group:
+                staged = in_dir / dwg_path.name
+                if not staged.exists():
+                    try:
+                        try:
+                            os.link(dwg_path, staged)
+                        except OSError:
+                            shutil.copy2(dwg_path, staged)
+                    except OSError as e:
+                        # Unreadable source, disk full...: fail this file only
+                        print(f"  Cannot stage {dwg_path.name}: {e}")
+                        staged.unlink(missing_ok=True)
+                        results[key] = None
+                        continue
+                staged_group.append((key, dwg_path))
+            group = staged_group
+            if not group:
+                continue
+
+            args = odafc._odafc_arguments(
+                '*.DWG', str(in_dir), str(out_dir),
+                output_format='DXF', version=version, audit=False,
+            )
+            try:
+                odafc._execute_odafc(args)
+                retry = False
+            except Exception as e:
+                print(f"  ODA File Converter failed on {len(group)} {version} files: {e}")
+                # The converter ran but choked (likely on one file): retry
+                # the missing ones singly. Not installed/platform errors
+                # would only repeat.
+                retry = isinstance(e, odafc.UnknownODAFCError)
+
+            for key, dwg_path in group:
+                tmp_dxf = out_dir / dwg_path.with_suffix('.dxf').name
+                if tmp_dxf.exists():
+                    dxf_path = cache_dir / tmp_dxf.name
+                    try:
+                        shutil.copy2(tmp_dxf, dxf_path)
+                    except OSError as e:
+                        # Never leave a partial DXF that later runs take as cached
+                        print(f"  Cannot cache {dxf_path.name}: {e}")
+                        dxf_path.unlink(missing_ok=True)
+                        results[key] = None
+                        continue
+                    results[key] = dxf_path
+                elif retry:
+                    try:
+                        results[key] = dwg_to_dxf(dwg_path, cache_dir)
+                    except Exception as e:
+                        print(f"  Cannot convert {dwg_path.name}: {e}")
+                        results[key] = None
+                else:
+                    results[key] = None
+
+    return results
+
+
+def extract_edges(stl_path, edge_path, angle_threshold=10, mesh=None):
     """Extract sharp edges from an STL and save as flat binary float32 pairs.
 
     Deduplicates the mesh (STL files often have duplicate faces), then finds
     edges where adjacent face normals diverge beyond the angle threshold.
+    Pass a welded `mesh` with the STL's float32 vertices to skip reading it
+    back.
     """
-    mesh = trimesh.load(str(stl_path))
-    mesh.merge_vertices()
+    if mesh is None:
+        mesh = trimesh.load(str(stl_path))
+        mesh.merge_vertices()
 
     threshold_dot = np.cos(np.radians(angle_threshold))
     verts = mesh.vertices
@@ -130,7 +248,40 @@ def extract_edges(stl_path, edge_path, angle_threshold=10):
     print(f"  -> {edge_path.name} ({size_kb:.0f} KB, {len(sharp):,} edges)")
 
 
-def _orient_outward(mesh):
+def _write_binary_stl(path, vertices, faces):
+    """Write a binary STL straight from vertex/face arrays.
+
+    80-byte zero header and uint32 triangle count, then the 50-byte records
+    are filled in place through a memory map of the sized file, a slice of
+    faces at a time, so the output is never held in RAM as a whole.
+    """
+    with open(path, 'wb') as f:
+        f.write(bytes(80))
+        np.array([len(faces)], dtype='<u4').tofile(f)
+        f.truncate(84 + len(faces) * STL_RECORD.itemsize)
+    if not len(faces):
+        return
+
+    records = np.memmap(path, dtype=STL_RECORD, mode='r+', offset=84, shape=(len(faces),))
+    for start in range(0, len(faces), STL_WRITE_CHUNK):
+        chunk = faces[start:start + STL_WRITE_CHUNK]
+        v0 = vertices[chunk[:, 0]]
+        v1 = vertices[chunk[:, 1]]
+        v2 = vertices[chunk[:, 2]]
+        normals = np.cross(v1 - v0, v2 - v0)
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        np.divide(normals, lengths, out=normals, where=lengths > 0)
+        # attr stays zero: the truncate above zero-fills the file
+        out = records[start:start + len(chunk)]
+        out['normal'] = normals
+        out['v0'] = v0
+        out['v1'] = v1
+        out['v2'] = v2
+    records.flush()
+    del records
+
+
+def _orient_outward(mesh, merge=True):
     """Orient face normals outward (away from each connected component's interior).
 
     Source DXF entities have unreliable winding: 3DFACE faces are individually
@@ -138,9 +289,11 @@ def _orient_outward(mesh):
     are handled by: merge by position, propagate a consistent winding through
     each component, then flip components whose topmost face points down (roofs
     must be up). Components without a clear up/down face (purely vertical) are
-    left as fix_winding put them.
+    left as fix_winding put them. Pass merge=False if vertices are already
+    welded.
     """
-    mesh.merge_vertices()
+    if merge:
+        mesh.merge_vertices()
     trimesh.repair.fix_winding(mesh)
     cc = trimesh.graph.connected_components(mesh.face_adjacency, min_len=1)
     flips = np.zeros(len(mesh.faces), dtype=bool)
@@ -161,8 +314,207 @@ def _orient_outward(mesh):
         mesh.faces = new_faces
 
 
-def dxf_to_stl(dxf_path, stl_path):
-    """Convert DXF file to STL."""
+def _merge_vertices(vertices, tol=VERTEX_TOL):
+    """Weld vertices that fall on the same `tol` grid point.
+
+    Returns (unique vertices, inverse) with vertices[i] ~ unique[inverse[i]].
+    """
+    keys = np.ascontiguousarray(np.rint(vertices / tol).astype(np.int64))
+    # One 24-byte void scalar per row: a 1-D unique instead of axis=0
+    rows = keys.view(np.dtype((np.void, keys.itemsize * 3))).reshape(-1)
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return vertices[first], inverse.reshape(-1)
+
+
+def _triangulate_faces(corners, valid=None, tol=VERTEX_TOL):
+    """Split (N, 4, 3) face corners into (M, 3, 3) triangles.
+
+    Corners within `tol` of an earlier corner of the same face are dropped
+    (a triangle stored as a quad repeats one), as are corners masked out by
+    the optional (N, 4) `valid` array. Faces left with 3 distinct corners
+    give one triangle, 4 give two, fewer give none. Triangles keep the face
+    order, so a quad's two halves stay adjacent.
+    """
+    keys = np.rint(corners / tol).astype(np.int64)
+    # dup[:, j]: corner j repeats one of corners 0..j-1
+    same = np.all(keys[:, :, None, :] == keys[:, None, :, :], axis=-1)
+    if valid is not None:
+        same &= valid[:, None, :]
+    dup = np.tril(same, k=-1).any(axis=2)
+    if valid is not None:
+        dup |= ~valid
+    if not dup.any():
+        # Clean input, every face a true quad: no compaction needed
+        return np.stack([corners[:, [0, 1, 2]], corners[:, [0, 2, 3]]], axis=1).reshape(-1, 3, 3)
+    count = 4 - dup.sum(axis=1)
+
+    # Stable sort moves the distinct corners to the front, in original order
+    order = np.argsort(dup, axis=1, kind='stable')
+    compact = np.take_along_axis(corners, order[:, :, None], axis=1)
+    triangles = np.stack([compact[:, [0, 1, 2]], compact[:, [0, 2, 3]]], axis=1)
+    keep = np.stack([count >= 3, count == 4], axis=1)
+    return triangles[keep]
+
+
+def _polyface_faces(polyface):
+    """(N, 4, 3) corners and (N, 4) validity mask of a poly-face-mesh POLYLINE.
+
+    ezdxf is only walked once to pull out vertex locations and the raw
+    1-based face indices; the index resolution itself is done with numpy.
+    """
+    nan = (np.nan, np.nan, np.nan)
+    locations = []
+    face_raw = []
+    for v in polyface.vertices:
+        # One DXFNamespace.get per attribute, no hasattr/getattr probing
+        d = v.dxf
+        loc = d.get('location')
+        locations.append(nan if loc is None else (loc.x, loc.y, loc.z))
+        if v.is_face_record:
+            face_raw.append((d.get('vtx0', 0), d.get('vtx1', 0),
+                             d.get('vtx2', 0), d.get('vtx3', 0)))
+    locations = np.array(locations, dtype=np.float64).reshape(-1, 3)
+    raw = np.array(face_raw, dtype=np.int64).reshape(-1, 4)
+
+    # Index 0 marks an unused corner; negative ones are invisible edges
+    index = np.abs(raw) - 1
+    valid = (raw != 0) & (index < len(locations))
+    corners = locations[np.where(valid, index, 0)] if len(locations) else np.zeros(raw.shape + (3,))
+    valid &= ~np.isnan(corners).any(axis=2)
+    corners[~valid] = 0.0
+    return corners, valid
+
+
+def _to_numpy(matrix):
+    """ezdxf Matrix44 as a (4, 4) array (row-vector convention, translation in row 3)."""
+    return np.array([matrix.get_row(i) for i in range(4)], dtype=np.float64)
+
+
+def _transform(points, m):
+    """Apply an affine (4, 4) row-vector matrix to an (..., 3) point array.
+
+    With a stacked (I, 4, 4) `m` and (P, 3) points the result is (I, P, 3).
+    """
+    return points @ m[..., :3, :3] + m[..., None, 3, :3]
+
+
+def _block_refs(insert, block_cache, executor=None):
+    """(block geometry, matrix) for an INSERT, or for each cell of a MINSERT.
+
+    `block_cache` maps block name -> (corners, valid) in block
+    coordinates, so a block is read once however often it is referenced.
+    """
+    name = insert.dxf.name
+    if name not in block_cache:
+        block = insert.block()
+        block_cache[name] = (_collect_geometry(block, block_cache, executor)
+                             if block is not None else None)
+    geometry = block_cache[name]
+    if geometry is None:
+        return []
+    inserts = insert.multi_insert() if insert.mcount > 1 else [insert]
+    return [(geometry, _to_numpy(ref.matrix44())) for ref in inserts]
+
+
+def _place(refs):
+    """Move block geometry into WCS: one stacked matmul per block.
+
+    References sharing a block are grouped and moved with an (I, 4, 4)
+    array of their matrices instead of one matmul each. Returns
+    (corners, valid) per reference, in reference order.
+    """
+    groups = {}
+    for slot, (geometry, m) in enumerate(refs):
+        group = groups.setdefault(id(geometry), (geometry, [], []))
+        group[1].append(slot)
+        group[2].append(m)
+
+    placed = [None] * len(refs)
+    for (corners, valid), slots, matrices in groups.values():
+        moved = _transform(corners.reshape(-1, 3), np.stack(matrices))
+        for slot, instance in zip(slots, moved.reshape(len(slots), -1, 4, 3)):
+            placed[slot] = (instance, valid)
+    return placed
+
+
+def _face_corners(face):
+    """The 4 corners of a 3DFACE as a flat 12-tuple."""
+    d = face.dxf
+    v0, v1, v2, v3 = d.vtx0, d.vtx1, d.vtx2, d.vtx3
+    return (v0.x, v0.y, v0.z, v1.x, v1.y, v1.z,
+            v2.x, v2.y, v2.z, v3.x, v3.y, v3.z)
+
+
+def _face_array(faces_3d):
+    """(N, 4, 3) corners and an all-true (N, 4) mask for a run of 3DFACEs."""
+    # Corners go straight into one preallocated array, no tuple list kept
+    corners = np.fromiter(map(_face_corners, faces_3d), dtype=(np.float64, 12),
+                          count=len(faces_3d)).reshape(-1, 4, 3)
+    return corners, np.ones((len(faces_3d), 4), dtype=bool)
+
+
+def _collect_geometry(entities, block_cache, executor=None):
+    """Gather (N, 4, 3) face corners and their (N, 4) validity mask.
+
+    3DFACEs and poly-face-mesh faces come out in source order, with block
+    references expanded in place, as recursive_decompose would. Block
+    geometry is extracted once in block coordinates and moved into place
+    with numpy.
+    """
+    parts = []   # (corners, valid) pairs, or the refs of one INSERT
+    faces_3d = []
+    refs = []
+    for entity in entities:
+        etype = entity.dxftype()
+
+        if etype == '3DFACE':
+            faces_3d.append(entity)
+            continue
+        if etype == 'POLYLINE' and entity.is_poly_face_mesh:
+            part = _polyface_faces(entity)
+        elif etype == 'INSERT':
+            part = _block_refs(entity, block_cache, executor)
+            refs.extend(part)
+        elif isinstance(entity, SupportsVirtualEntities):
+            # DIMENSION, proxy entities etc.: let ezdxf decompose them
+            part = _collect_geometry(recursive_decompose([entity]), block_cache, executor)
+        else:
+            continue
+        # Close the run of 3DFACEs before this entity
+        if faces_3d:
+            parts.append(_face_array(faces_3d))
+            faces_3d = []
+        parts.append(part)
+    if faces_3d:
+        parts.append(_face_array(faces_3d))
+
+    # The matmuls release the GIL, so batches of references run in parallel
+    if executor is not None and len(refs) > INSERT_BATCH:
+        batches = [refs[i:i + INSERT_BATCH] for i in range(0, len(refs), INSERT_BATCH)]
+        placed = [p for batch in executor.map(_place, batches) for p in batch]
+    else:
+        placed = _place(refs)
+
+    # Put each INSERT's placed geometry in its slot
+    ordered = []
+    placed = iter(placed)
+    for part in parts:
+        if isinstance(part, list):
+            ordered.extend(next(placed) for _ in part)
+        else:
+            ordered.append(part)
+    if not ordered:
+        return np.empty((0, 4, 3)), np.empty((0, 4), dtype=bool)
+    return (np.concatenate([c for c, _ in ordered]),
+            np.concatenate([v for _, v in ordered]))
+
+
+def dxf_to_stl(dxf_path, stl_path, threads=1):
+    """Convert DXF file to STL.
+
+    `threads` > 1 places block references on a thread pool. Batch runs
+    already use one process per core, so they keep the default.
+    """
     dxf_path = Path(dxf_path)
     stl_path = Path(stl_path)
 
@@ -173,87 +525,50 @@ def dxf_to_stl(dxf_path, stl_path):
     # where the 4th vertex equals the 3rd (per the AutoCAD spec). We detect
     # that at the source instead of producing a degenerate triangle and
     # filtering it out later.
-    all_triangles = []
-    for entity in recursive_decompose(msp):
-        etype = entity.dxftype()
-
-        if etype == '3DFACE':
-            v0 = (entity.dxf.vtx0.x, entity.dxf.vtx0.y, entity.dxf.vtx0.z)
-            v1 = (entity.dxf.vtx1.x, entity.dxf.vtx1.y, entity.dxf.vtx1.z)
-            v2 = (entity.dxf.vtx2.x, entity.dxf.vtx2.y, entity.dxf.vtx2.z)
-            v3 = (entity.dxf.vtx3.x, entity.dxf.vtx3.y, entity.dxf.vtx3.z)
-            all_triangles.append([v0, v1, v2])
-            if v3 != v2:  # genuine quad
-                all_triangles.append([v0, v2, v3])
-
-        elif etype == 'POLYLINE' and entity.is_poly_face_mesh:
-            vertex_list = list(entity.vertices)
-            coords = {}
-            for i, v in enumerate(vertex_list):
-                loc = getattr(v.dxf, 'location', None)
-                if loc is not None:
-                    coords[i] = (loc.x, loc.y, loc.z)
-            for v in vertex_list:
-                if getattr(v.dxf, 'vtx0', None) is None:
-                    continue
-                # Collect indices, dropping zeros (unused) and any that
-                # repeat (triangle encoded as quad).
-                indices = []
-                for attr in ('vtx0', 'vtx1', 'vtx2', 'vtx3'):
-                    idx = getattr(v.dxf, attr, None)
-                    if idx is None or idx == 0:
-                        continue
-                    actual = abs(idx) - 1
-                    if actual in indices or actual not in coords:
-                        continue
-                    indices.append(actual)
-                if len(indices) == 3:
-                    all_triangles.append([coords[i] for i in indices])
-                elif len(indices) >= 4:
-                    p = [coords[i] for i in indices]
-                    all_triangles.append([p[0], p[1], p[2]])
-                    all_triangles.append([p[0], p[2], p[3]])
-
-    if not all_triangles:
+    with ThreadPoolExecutor(threads) if threads > 1 else nullcontext() as executor:
+        corners, valid = _collect_geometry(msp, {}, executor)
+    triangles = _triangulate_faces(corners, valid)
+    if not len(triangles):
         raise RuntimeError("No valid 3D geometry found!")
 
-    n = len(all_triangles)
-    vertices = np.empty((n * 3, 3), dtype=np.float64)
-    faces = np.empty((n, 3), dtype=np.int32)
-
-    for i, tri in enumerate(all_triangles):
-        base = i * 3
-        vertices[base] = tri[0]
-        vertices[base + 1] = tri[1]
-        vertices[base + 2] = tri[2]
-        faces[i] = (base, base + 1, base + 2)
+    n = len(triangles)
+    # Share vertices between faces up front (hash by grid cell, no KD-tree)
+    vertices, inverse = _merge_vertices(triangles.reshape(-1, 3))
+    faces = inverse.reshape(-1, 3)
 
     mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
-    _orient_outward(mesh)
+    _orient_outward(mesh, merge=False)
     # Backstop: drop any near-zero-area triangles that survived dedup.
     mesh.update_faces(mesh.nondegenerate_faces(height=1e-9))
     mesh.remove_unreferenced_vertices()
-    mesh.export(str(stl_path))
+    _write_binary_stl(stl_path, mesh.vertices, mesh.faces)
 
     size_mb = stl_path.stat().st_size / (1024 * 1024)
     print(f"  -> {stl_path.name} ({size_mb:.1f} MB, {len(mesh.faces):,} faces, {n - len(mesh.faces):,} dropped)")
 
-    # Extract precomputed edges
+    # Extract precomputed edges from the mesh as written, not the float64
+    # one: at Lambert-72 magnitudes a float32 step is ~1 cm, so vertices the
+    # 1 mm weld kept apart can coincide in the STL. Reweld after rounding so
+    # the result matches reloading the STL (as regen_edges.py does).
+    if stl_path.name.startswith(('Geb_', 'Trn_')):
+        mesh = trimesh.Trimesh(vertices=mesh.vertices.astype(np.float32),
+                               faces=mesh.faces, process=False)
+        mesh.merge_vertices()
     if stl_path.name.startswith('Geb_'):
         edge_path = stl_path.with_name(
             stl_path.name.replace('Geb_', 'Edg_').replace('.stl', '.bin')
         )
-        extract_edges(stl_path, edge_path)
+        extract_edges(stl_path, edge_path, mesh=mesh)
     elif stl_path.name.startswith('Trn_'):
         edge_path = stl_path.with_name(
             stl_path.name.replace('Trn_', 'TrnEdg_').replace('.stl', '.bin')
         )
-        extract_edges(stl_path, edge_path, angle_threshold=3)
+        extract_edges(stl_path, edge_path, angle_threshold=3, mesh=mesh)
 
     return stl_path
 
 
-def cad_to_stl(cad_path, stl_path=None, cache_dir=None):
+def cad_to_stl(cad_path, stl_path=None, cache_dir=None, threads=1):
     """Convert DWG/DXF file to STL. Caches intermediate DXF for DWG files."""
     cad_path = Path(cad_path)
     if not cad_path.exists():
@@ -270,7 +585,7 @@ def cad_to_stl(cad_path, stl_path=None, cache_dir=None):
     else:
         dxf_path = cad_path
 
-    return dxf_to_stl(dxf_path, stl_path)
+    return dxf_to_stl(dxf_path, stl_path, threads)
 
 
 if __name__ == "__main__":
@@ -282,7 +597,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     try:
-        cad_to_stl(input_file, output_file)
+        cad_to_stl(input_file, output_file, threads=os.cpu_count() or 1)
     except Exception as e:
         print(f"\nERROR: {e}")
         import traceback
@@ -3,6 +3,7 @@ Inspect DWG file to see what entity types it contains
 """
 
 import sys
+from collections import Counter
 from pathlib import Path
 
 try:
@@ -89,15 +90,12 @@ def inspect_dwg(dwg_path):
         msp = doc.modelspace()
         print(f"\nModelspace entities: {len(msp)}")
 
-        # Count entity types
-        entity_types = {}
-        for entity in msp:
-            entity_type = entity.dxftype()
-            entity_types[entity_type] = entity_types.get(entity_type, 0) + 1
+        # Count entity types in a single pass; the checks below reuse it
+        entity_types = Counter(entity.dxftype() for entity in msp)
 
         print("\nEntity types found:")
         print("-" * 60)
-        for etype, count in sorted(entity_types.items(), key=lambda x: -x[1]):
+        for etype, count in entity_types.most_common():
             print(f"  {etype:20s} : {count:6d}")
 
         # Look for 3D entities
@@ -111,12 +109,9 @@ def inspect_dwg(dwg_path):
         if 'INSERT' in entity_types:
             print(f"\n[OK] Found {entity_types['INSERT']} INSERT (block references)")
             print("  Blocks found:")
-            block_refs = {}
-            for entity in msp.query('INSERT'):
-                block_name = entity.dxf.name
-                block_refs[block_name] = block_refs.get(block_name, 0) + 1
+            block_refs = Counter(entity.dxf.name for entity in msp.query('INSERT'))
 
-            for block_name, count in sorted(block_refs.items(), key=lambda x: -x[1])[:20]:
+            for block_name, count in block_refs.most_common(20):
                 print(f"    {block_name:30s} : {count} instances")
             has_3d = True
 
@@ -132,10 +127,8 @@ def inspect_dwg(dwg_path):
 
         # Check for polyface meshes
         if 'POLYLINE' in entity_types:
-            polyface_count = 0
-            for entity in msp.query('POLYLINE'):
-                if entity.is_poly_face_mesh:
-                    polyface_count += 1
+            polyface_count = sum(1 for entity in msp.query('POLYLINE')
+                                 if entity.is_poly_face_mesh)
             if polyface_count > 0:
                 print(f"\n[OK] Found {polyface_count} POLYFACE MESH entities")
                 has_3d = True
@@ -160,10 +153,7 @@ def inspect_dwg(dwg_path):
                 print(f"  Entities: {len(block)}")
 
                 # Count entity types in block
-                block_entities = {}
-                for entity in block:
-                    etype = entity.dxftype()
-                    block_entities[etype] = block_entities.get(etype, 0) + 1
+                block_entities = Counter(entity.dxftype() for entity in block)
 
                 for etype, count in list(block_entities.items())[:5]:
                     print(f"    {etype}: {count}")